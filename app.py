@@ -1,10 +1,24 @@
 from flask import Flask, request, jsonify, render_template, redirect, url_for
+import colorsys
+import io
 import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
 import cv2
+import numpy as np
+import torch
+from numba import njit
+from concurrent.futures import Future, ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 from ultralytics import YOLO
-from shutil import copyfile
 from werkzeug.utils import secure_filename
-from PIL import Image, UnidentifiedImageError, ImageDraw, ImageFont
+from PIL import JpegImagePlugin
 
 """
 Flask application for object detection and product management.
@@ -15,25 +29,189 @@ Features:
 - YOLOv8 model for detecting objects in uploaded images
 - Bounding box overlay on detected objects with product information
 
-Technologies Used: Flask, YOLOv8, OpenCV, PIL, SQL-like product storage.
+Technologies Used: Flask, YOLOv8, OpenCV, PIL, SQLite product storage.
 """
 
 # Initialize Flask application
 app = Flask(__name__)
 
 # Configuration
-app.config['UPLOAD_FOLDER'] = 'uploads'  # Folder for uploaded images
 app.config['STATIC_FOLDER'] = 'static'    # Folder for static files
+app.config['OUTPUT_FOLDER'] = os.path.join(app.config['STATIC_FOLDER'], 'uploads')  # Annotated images, served as-is
+app.config['DATABASE'] = 'products.db'    # SQLite file for product information
+
+# Ensure the output directory exists
+os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+
+# SQLite connection shared by request and job threads; the lock serializes access to it
+db = None
+db_lock = threading.Lock()
+
+# YOLO model configuration
+YOLO_WEIGHTS = 'yolov8n.pt'                 # PyTorch weights
+YOLO_ENGINE = 'yolov8n.engine'              # TensorRT engine for CUDA GPUs
+YOLO_OPENVINO = 'yolov8n_openvino_model'    # OpenVINO model for CPU-only hosts
+YOLO_OPENVINO_INT8 = 'yolov8n_int8_openvino_model'  # INT8-quantized OpenVINO model
+INT8_CALIBRATION_DATA = os.environ.get('YOLO_INT8_DATA')  # Dataset YAML to calibrate INT8 on CPU; unset keeps FP16
+MODEL_IMGSZ = 640                # Square model input size (images are letterboxed to it)
+MAX_BATCH = 8                    # Max images per batched inference call
+BATCH_WINDOW = 0.01              # Seconds to wait for more images before running a batch
+USE_CUDA = torch.cuda.is_available()
+
+# Extra arguments for every prediction call (FP16 on the first GPU when available)
+YOLO_PREDICT_ARGS = {'imgsz': MODEL_IMGSZ, 'verbose': False}
+if USE_CUDA:
+    YOLO_PREDICT_ARGS.update(device=0, half=True)
+else:
+    # Compiles the OpenVINO model with the CUMULATIVE_THROUGHPUT hint, which runs the
+    # images of a batch as parallel infer requests across CPU streams
+    YOLO_PREDICT_ARGS.update(batch=MAX_BATCH)
+
+def export_model(path, **export_args):
+    """
+    Export the PyTorch weights to another format unless the export already exists.
+
+    Args:
+        path (str): Path the exported model is written to.
+        **export_args: Arguments for YOLO.export().
+    """
+    with open(path + '.lock', 'w') as lock_file:
+        # With several server workers, one exports the model while the others wait
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not os.path.exists(path):
+            YOLO(YOLO_WEIGHTS).export(**export_args)
+
+def load_yolo_model():
+    """
+    Load the YOLO model in the fastest format for this host.
+
+    CUDA GPUs use a TensorRT FP16 engine and CPU-only hosts an OpenVINO model, both
+    exported once from the PyTorch weights and reused on later starts. On CPU the
+    OpenVINO model is INT8-quantized if calibration data is configured, falling back to
+    FP16 if quantization fails. Falls back to the PyTorch weights if the export fails.
+
+    Returns:
+        YOLO: Loaded YOLO model.
+    """
+    try:
+        if USE_CUDA:
+            export_model(YOLO_ENGINE, format='engine', half=True, imgsz=MODEL_IMGSZ, dynamic=True, batch=MAX_BATCH)
+            return YOLO(YOLO_ENGINE, task='detect')
+        if INT8_CALIBRATION_DATA:
+            try:
+                export_model(YOLO_OPENVINO_INT8, format='openvino', int8=True, data=INT8_CALIBRATION_DATA, imgsz=MODEL_IMGSZ, dynamic=True)
+                return YOLO(YOLO_OPENVINO_INT8, task='detect')
+            except Exception as e:
+                print(f"Error quantizing YOLO model to INT8, using FP16 OpenVINO model: {e}")
+        export_model(YOLO_OPENVINO, format='openvino', half=True, imgsz=MODEL_IMGSZ, dynamic=True)
+        return YOLO(YOLO_OPENVINO, task='detect')
+    except Exception as e:
+        print(f"Error exporting YOLO model, using PyTorch weights: {e}")
+        if USE_CUDA:
+            # Allow TF32 for any matmuls that stay in FP32 under half-precision inference
+            torch.set_float32_matmul_precision('high')
+        return YOLO(YOLO_WEIGHTS)
+
+def warm_up_model(model, runs=3):
+    """
+    Run dummy inferences so CUDA init and kernel selection happen before the first request.
+
+    Args:
+        model (YOLO): Model to warm up.
+        runs (int): Number of dummy inferences.
+    """
+    dummy = np.zeros((MODEL_IMGSZ, MODEL_IMGSZ, 3), dtype=np.uint8)
+    for _ in range(runs):
+        model(dummy, **YOLO_PREDICT_ARGS)
+
+# YOLO model, loaded per process by init_detector()
+yolo_model = None
+detector_lock = threading.Lock()
+
+# Queue of (image, Future) pairs waiting for batched inference
+detection_queue = queue.Queue()
+
+def run_detection_batches():
+    """
+    Coalesce queued images into batched YOLO calls (runs on a background thread).
+
+    Waits for one image, then collects more for up to BATCH_WINDOW seconds or until
+    MAX_BATCH images are queued, runs a single prediction and resolves each future.
+    """
+    while True:
+        batch = [detection_queue.get()]
+        deadline = time.monotonic() + BATCH_WINDOW
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(detection_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            results = yolo_model([image for image, _ in batch], **YOLO_PREDICT_ARGS)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            continue
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+def init_detector():
+    """
+    Load and warm up the YOLO model and start the batching thread, once per process.
+
+    Under gunicorn this runs in each worker's post_fork hook, since CUDA contexts and
+    threads do not survive a fork. Otherwise it runs before the dev server starts, or
+    on the first detection as a fallback.
+    """
+    global yolo_model
+    with detector_lock:
+        if yolo_model is not None:
+            return
+        model = load_yolo_model()
+        warm_up_model(model)
+        yolo_model = model
+        threading.Thread(target=run_detection_batches, daemon=True).start()
+
+# Uploads are processed in the background; the batching thread still serializes GPU work,
+# so allow enough jobs in flight to fill a batch
+job_executor = ThreadPoolExecutor(max_workers=MAX_BATCH)
+jobs = {}  # Job ID -> (Future returning the output image path, submit time)
+JOB_TTL = 600  # Seconds a finished job is kept for polling before it is dropped
+
+def expire_jobs():
+    """
+    Drop finished jobs older than JOB_TTL, e.g. when the client never polled for them.
+    """
+    cutoff = time.monotonic() - JOB_TTL
+    for job_id, (future, submitted) in list(jobs.items()):
+        if future.done() and submitted < cutoff:
+            jobs.pop(job_id, None)
+
+# Font settings for product labels drawn with OpenCV
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_FONT_SCALE = 0.6
+LABEL_THICKNESS = 2
 
-# Ensure the upload and static directories exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(os.path.join(app.config['STATIC_FOLDER'], 'uploads'), exist_ok=True)
+# Fixed BGR color per YOLO class ID (80 COCO classes), with hues spread by the golden ratio
+# so neighbouring IDs get distinct colors and a product keeps its color across requests
+PALETTE = [
+    tuple(int(v * 255) for v in reversed(colorsys.hsv_to_rgb((i * 0.618034) % 1.0, 0.8, 0.9)))
+    for i in range(80)
+]
 
-# In-memory storage for product information
-products = {}
+# Annotated images are always written as JPEG, at a quality that suits a web preview
+OUTPUT_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 0, cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
 
-# Load YOLO model once at startup for efficiency
-yolo_model = YOLO('yolov8n.pt')
+# Reduced-size JPEG decodes supported by OpenCV, largest factor first
+REDUCED_DECODE_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+# Max width and height of uploads after resizing; reduced decodes never go below it
+MAX_IMAGE_SIZE = (1024, 1024)
 
 # Allowed file extensions for image uploads
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
@@ -50,17 +228,98 @@ def allowed_file(filename):
     """
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_new_product_id():
+def get_db():
+    """
+    Return this process's SQLite connection, creating the products table on first use.
+
+    Opened lazily so gunicorn workers never share a connection inherited across a fork.
+    Callers must hold db_lock.
+
+    Returns:
+        sqlite3.Connection: Database connection.
+    """
+    global db
+    if db is None:
+        db = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        with db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL COLLATE NOCASE,
+                    price REAL NOT NULL,
+                    in_stock INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_products_name ON products (name COLLATE NOCASE);
+            """)
+    return db
+
+def query_db(query, args=(), one=False):
+    """
+    Run a parameterized SELECT query.
+
+    Args:
+        query (str): SQL query.
+        args (tuple): Query parameters.
+        one (bool): Return only the first row.
+    
+    Returns:
+        list or sqlite3.Row: Matching rows, or the first row (None if there is none) when one is True.
+    """
+    with db_lock:
+        rows = get_db().execute(query, args).fetchall()
+    if one:
+        return rows[0] if rows else None
+    return rows
+
+def execute_db(query, args=()):
+    """
+    Run a parameterized INSERT, UPDATE or DELETE statement in its own transaction.
+
+    Args:
+        query (str): SQL statement.
+        args (tuple): Statement parameters.
+    
+    Returns:
+        sqlite3.Cursor: Cursor with lastrowid and rowcount of the statement.
+    """
+    with db_lock:
+        connection = get_db()
+        with connection:
+            return connection.execute(query, args)
+
+def parse_product_id(product_id):
+    """
+    Convert a product ID such as "001" to its database key.
+
+    Args:
+        product_id (str): Product ID from the URL.
+    
+    Returns:
+        int: Database key, or None if the ID is not a plain number in SQLite's integer range.
+    """
+    # Digits only, so strings like " 1" or "0_1" that int() accepts don't alias a product
+    if not (product_id.isascii() and product_id.isdigit()):
+        return None
+    key = int(product_id)
+    return key if key < 2 ** 63 else None
+
+def row_to_product(row):
     """
-    Generate a new product ID.
+    Convert a products table row to a product dict.
 
+    Args:
+        row (sqlite3.Row): Row from the products table.
+    
     Returns:
-        str: New product ID.
+        dict: Product with a zero-padded string ID.
     """
-    if products:
-        max_id = max(int(pid) for pid in products.keys())
-        return f"{max_id + 1:03d}"
-    return "001"
+    return {
+        'id': f"{row['id']:03d}",
+        'name': row['name'],
+        'price': row['price'],
+        'in_stock': bool(row['in_stock'])
+    }
 
 # --------------------------- Root Route --------------------------- #
 
@@ -83,9 +342,9 @@ def create_product():
     if 'name' not in product or 'price' not in product:
         return jsonify({'error': 'Missing name or price.'}), 400
 
-    product_id = generate_new_product_id()
-    product['id'] = product_id
-    products[product_id] = product
+    cursor = execute_db('INSERT INTO products (name, price, in_stock) VALUES (?, ?, ?)',
+                        (product['name'], product['price'], bool(product.get('in_stock'))))
+    product_id = f"{cursor.lastrowid:03d}"
     return jsonify({'message': 'Product created successfully.', 'id': product_id}), 201
 
 @app.route('/api/products/<product_id>', methods=['GET'])
@@ -99,9 +358,9 @@ def get_product(product_id):
     Returns:
         JSON: Product details or error message.
     """
-    product = products.get(product_id)
-    if product:
-        return jsonify(product), 200
+    row = query_db('SELECT * FROM products WHERE id = ?', (parse_product_id(product_id),), one=True)
+    if row:
+        return jsonify(row_to_product(row)), 200
     return jsonify({'error': 'Product not found.'}), 404
 
 @app.route('/api/products/<product_id>', methods=['PUT'])
@@ -115,12 +374,12 @@ def update_product(product_id):
     Returns:
         JSON: Success or error message.
     """
-    if product_id in products:
-        product = request.get_json()
-        if 'name' not in product or 'price' not in product:
-            return jsonify({'error': 'Missing name or price.'}), 400
-        product['id'] = product_id  # Ensure the ID remains the same
-        products[product_id] = product
+    product = request.get_json()
+    if 'name' not in product or 'price' not in product:
+        return jsonify({'error': 'Missing name or price.'}), 400
+    cursor = execute_db('UPDATE products SET name = ?, price = ?, in_stock = ? WHERE id = ?',
+                        (product['name'], product['price'], bool(product.get('in_stock')), parse_product_id(product_id)))
+    if cursor.rowcount:
         return jsonify({'message': 'Product updated successfully.'}), 200
     return jsonify({'error': 'Product not found.'}), 404
 
@@ -135,8 +394,8 @@ def delete_product(product_id):
     Returns:
         JSON: Success or error message.
     """
-    if product_id in products:
-        del products[product_id]
+    cursor = execute_db('DELETE FROM products WHERE id = ?', (parse_product_id(product_id),))
+    if cursor.rowcount:
         return jsonify({'message': 'Product deleted successfully.'}), 200
     return jsonify({'error': 'Product not found.'}), 404
 
@@ -145,7 +404,8 @@ def delete_product(product_id):
 @app.route('/products', methods=['GET'])
 def list_products():
     """Render the product list page."""
-    return render_template('products.html', products=products.values())
+    products = [row_to_product(row) for row in query_db('SELECT * FROM products ORDER BY id')]
+    return render_template('products.html', products=products)
 
 @app.route('/add_product', methods=['GET', 'POST'])
 def add_product():
@@ -156,14 +416,8 @@ def add_product():
         HTML: Redirect to product list page or rendered add product page.
     """
     if request.method == 'POST':
-        product_id = generate_new_product_id()
-        product = {
-            'id': product_id,
-            'name': request.form['name'],
-            'price': float(request.form['price']),
-            'in_stock': 'in_stock' in request.form
-        }
-        products[product_id] = product
+        execute_db('INSERT INTO products (name, price, in_stock) VALUES (?, ?, ?)',
+                   (request.form['name'], float(request.form['price']), 'in_stock' in request.form))
         return redirect(url_for('list_products'))
     return render_template('add_product.html')
 
@@ -178,15 +432,14 @@ def edit_product(product_id):
     Returns:
         HTML: Redirect to product list page or rendered edit product page.
     """
-    product = products.get(product_id)
-    if not product:
+    row = query_db('SELECT * FROM products WHERE id = ?', (parse_product_id(product_id),), one=True)
+    if not row:
         return 'Product not found!', 404
     if request.method == 'POST':
-        product['name'] = request.form['name']
-        product['price'] = float(request.form['price'])
-        product['in_stock'] = 'in_stock' in request.form
+        execute_db('UPDATE products SET name = ?, price = ?, in_stock = ? WHERE id = ?',
+                   (request.form['name'], float(request.form['price']), 'in_stock' in request.form, row['id']))
         return redirect(url_for('list_products'))
-    return render_template('edit_product.html', product=product)
+    return render_template('edit_product.html', product=row_to_product(row))
 
 @app.route('/delete_product/<product_id>', methods=['GET'])
 def delete_product_web(product_id):
@@ -199,8 +452,8 @@ def delete_product_web(product_id):
     Returns:
         HTML: Redirect to product list page or error message.
     """
-    if product_id in products:
-        del products[product_id]
+    cursor = execute_db('DELETE FROM products WHERE id = ?', (parse_product_id(product_id),))
+    if cursor.rowcount:
         return redirect(url_for('list_products'))
     return 'Product not found!', 404
 
@@ -222,68 +475,123 @@ def upload_image():
             return render_template('upload.html', error='No selected image.')
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
             
-            # Validate image file
-            try:
-                img = Image.open(filepath)
-                img.verify()
-            except (UnidentifiedImageError, IOError):
-                os.remove(filepath)
+            # Decode the upload straight from memory; a failed decode means an invalid image
+            image = decode_image(file.read())
+            if image is None:
                 return render_template('upload.html', error="Uploaded file is not a valid image.")
             
-            # Resize and process the image
-            filepath = resize_image(filepath)
-            output_image_path = process_image(filepath)
-            if output_image_path is None:
-                os.remove(filepath)
-                return render_template('upload.html', error="Sorry, we couldn't process the image.")
-            else:
-                static_output_path = os.path.join(app.config['STATIC_FOLDER'], 'uploads', os.path.basename(output_image_path))
-                copyfile(output_image_path, static_output_path)
-                return render_template('display_image.html', image_filename=os.path.basename(output_image_path))
+            # Resize, then process the image in the background while the client polls for the result
+            image = resize_image(image)
+            job_id = uuid.uuid4().hex
+            # The job ID keeps the name unique; cap the client's stem to stay within file name limits
+            output_filename = f'output_{job_id}_{os.path.splitext(filename)[0][:50]}.jpg'
+            expire_jobs()
+            jobs[job_id] = (job_executor.submit(process_image, image, output_filename), time.monotonic())
+            return render_template('processing.html', job_id=job_id), 202
         return render_template('upload.html', error="Unsupported file type. Please upload a PNG or JPEG image.")
     return render_template('upload.html')
 
+@app.route('/result/<job_id>', methods=['GET'])
+def image_result(job_id):
+    """
+    Show the result of a background image processing job.
+
+    Args:
+        job_id (str): Job ID returned by the upload.
+    
+    Returns:
+        HTML: Processing page (202) while pending, then a redirect to the result image or an error.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return 'Job not found!', 404
+    future = job[0]
+    if not future.done():
+        return render_template('processing.html', job_id=job_id), 202
+
+    # Overlapping polls may both get here, so tolerate the job being gone already
+    jobs.pop(job_id, None)
+    if future.exception() is not None:
+        print(f"Error during image processing: {future.exception()}")
+        return render_template('upload.html', error="Sorry, we couldn't process the image.")
+    output_image_path = future.result()
+    if output_image_path is None:
+        return render_template('upload.html', error="Sorry, we couldn't process the image.")
+    # The result page is built from the output file alone, so it stays valid on reload
+    return redirect(url_for('show_result', filename=os.path.basename(output_image_path)))
+
+@app.route('/result/image/<filename>', methods=['GET'])
+def show_result(filename):
+    """
+    Show a processed image.
+
+    Args:
+        filename (str): Name of the annotated image in the output folder.
+    
+    Returns:
+        HTML: Rendered display image page or an error.
+    """
+    filename = secure_filename(filename)
+    if not os.path.isfile(os.path.join(app.config['OUTPUT_FOLDER'], filename)):
+        return 'Image not found!', 404
+    return render_template('display_image.html', image_filename=filename)
+
 # --------------------------- Helper Functions --------------------------- #
 
-def process_image(image_path):
+def process_image(image, output_filename):
     """
     Process image for object detection and overlay product info.
 
     Args:
-        image_path (str): Path to the image.
+        image (np.ndarray): BGR image.
+        output_filename (str): File name for the annotated output image.
     
     Returns:
         str: Path to the output image with overlaid product info.
     """
-    detections = perform_object_detection(image_path)
+    detections = perform_object_detection(image)
     if detections is None:
         return None
     product_infos = get_product_info(detections)
-    return overlay_product_info(image_path, product_infos)
+    return overlay_product_info(image, product_infos, output_filename)
 
-def perform_object_detection(image_path):
+def perform_object_detection(image):
     """
     Perform object detection using YOLOv8 model.
 
     Args:
-        image_path (str): Path to input image.
+        image (np.ndarray): BGR input image.
     
     Returns:
-        list: List of detected objects with class names, bounding boxes, and scores.
+        dict: Detected objects as arrays: 'bboxes' (N, 4), 'scores' (N,), 'class_ids' (N,) and 'names' (N class names).
     """
     try:
-        results = yolo_model(image_path)
-        detections = []
-        for result in results:
-            for box, score, label in zip(result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy(), result.boxes.cls.cpu().numpy()):
-                class_id = int(label)
-                class_name = yolo_model.names[class_id]
-                bbox = box.astype(int)
-                detections.append({'class_name': class_name, 'bbox': bbox, 'score': score})
-        return detections
+        if yolo_model is None:
+            init_detector()
+
+        # Letterbox to the model input size here so YOLO does not resize again
+        model_input, scale, (pad_x, pad_y) = letterbox_image(image, MODEL_IMGSZ)
+
+        # Hand the image to the batching thread and wait for its result
+        future = Future()
+        detection_queue.put((model_input, future))
+        result = future.result()
+
+        # Copy all box data (xmin, ymin, xmax, ymax, score, class per row) to the host at once
+        data = result.boxes.data.cpu().numpy()
+        labels = data[:, 5].astype(np.int32)
+
+        # Map boxes from the letterboxed input back to the image
+        height, width = image.shape[:2]
+        bboxes = (data[:, :4] - (pad_x, pad_y, pad_x, pad_y)) / scale
+        bboxes = np.clip(bboxes, 0, (width, height, width, height))
+        return {
+            'bboxes': bboxes.astype(np.int32),
+            'scores': data[:, 4],
+            'class_ids': labels,
+            'names': [yolo_model.names[label] for label in labels.tolist()],
+        }
     except Exception as e:
         print(f"Error during object detection: {e}")
         return None
@@ -293,146 +601,219 @@ def get_product_info(detections):
     Get product information for detected objects.
 
     Args:
-        detections (list): List of detected objects.
+        detections (dict): Detected objects from perform_object_detection.
     
     Returns:
         list: Product information for detected objects.
     """
+    class_names = [name.lower() for name in detections['names']]
+
+    # Fetch the products for all distinct classes in one query; names compare
+    # case-insensitively via the name index. If several products share a name,
+    # the newest one wins since rows come back in ID order.
+    distinct_names = list(set(class_names))
+    product_lookup = {}
+    if distinct_names:
+        placeholders = ', '.join('?' * len(distinct_names))
+        for row in query_db(f'SELECT * FROM products WHERE name IN ({placeholders}) ORDER BY id', distinct_names):
+            product_lookup[row['name'].lower()] = row_to_product(row)
+
+    # Keep only detections whose class matches a product
+    mask = np.array([name in product_lookup for name in class_names], dtype=bool)
+    matched_names = [name for name, matched in zip(class_names, mask) if matched]
+
     product_infos = []
-    product_lookup = {product['name'].lower(): product for product in products.values()}
-    for detection in detections:
-        class_name = detection['class_name'].lower()
-        if class_name in product_lookup:
-            product = product_lookup[class_name]
-            product_info = {
-                'class_name': class_name,
-                'bbox': detection['bbox'],
-                'price': product['price'],
-                'in_stock': product['in_stock']
-            }
-            product_infos.append(product_info)
+    for class_name, class_id, bbox in zip(matched_names, detections['class_ids'][mask].tolist(), detections['bboxes'][mask]):
+        product = product_lookup[class_name]
+        product_info = {
+            'class_name': class_name,
+            'class_id': class_id,
+            'bbox': bbox,
+            'price': product['price'],
+            'in_stock': product['in_stock']
+        }
+        product_infos.append(product_info)
     return product_infos
 
-def overlay_product_info(image_path, product_infos):
+@njit('int32[:, :](int32[:, :], int32[:], int32[:, :], int64, int64)', cache=True)
+def layout_labels(bboxes, type_ids, text_sizes, image_width, image_height):
+    """
+    Compute label positions, one per product type, next to its largest bounding box.
+
+    Labels go above the box, or below it if there is no room, and are kept inside the image.
+    Compiled with Numba since it is pure arithmetic over the box arrays.
+
+    Args:
+        bboxes (np.ndarray): (N, 4) boxes as xmin, ymin, xmax, ymax.
+        type_ids (np.ndarray): (N,) product type index of each box, in 0..K-1.
+        text_sizes (np.ndarray): (K, 2) label width and height per product type.
+        image_width (int): Image width.
+        image_height (int): Image height.
+    
+    Returns:
+        np.ndarray: (K, 2) top-left x, y of each label.
+    """
+    num_types = text_sizes.shape[0]
+
+    # Choose largest bounding box of each product type for text positioning
+    largest_area = np.full(num_types, -1, np.int64)
+    largest_box = np.zeros(num_types, np.int64)
+    for i in range(bboxes.shape[0]):
+        area = (bboxes[i, 2] - bboxes[i, 0]) * (bboxes[i, 3] - bboxes[i, 1])
+        type_id = type_ids[i]
+        if area > largest_area[type_id]:
+            largest_area[type_id] = area
+            largest_box[type_id] = i
+
+    positions = np.empty((num_types, 2), np.int32)
+    for type_id in range(num_types):
+        box = largest_box[type_id]
+        text_width = text_sizes[type_id, 0]
+        text_height = text_sizes[type_id, 1]
+        text_x = bboxes[box, 0]
+        text_y = bboxes[box, 1] - text_height - 5
+
+        # Adjust text position if it goes beyond image boundaries
+        if text_x + text_width > image_width:
+            text_x = image_width - text_width - 5
+        if text_y < 0:
+            text_y = bboxes[box, 3] + 5
+            if text_y + text_height > image_height:
+                text_y = image_height - text_height - 5
+
+        positions[type_id, 0] = text_x
+        positions[type_id, 1] = text_y
+    return positions
+
+def overlay_product_info(image, product_infos, output_filename):
     """
     Overlay bounding boxes and product information onto the image, with different colors for each product type.
 
     Args:
-        image_path (str): Path to the input image.
+        image (np.ndarray): BGR input image, annotated in place.
         product_infos (list): Product information to overlay.
+        output_filename (str): File name for the output JPEG image.
     
     Returns:
-        str: Path to the output image.
+        str: Path to the output image, or None if it could not be written.
     """
-    # Load image with PIL for better text rendering
-    image = Image.open(image_path).convert("RGB")
-    draw = ImageDraw.Draw(image)
-    
-    # Define a set of colors to be used for different bounding boxes (RGB)
-    colors = [
-        (255, 0, 0),   # Red
-        (0, 255, 0),   # Green
-        (0, 0, 255),   # Blue
-        (255, 255, 0), # Yellow
-        (255, 165, 0), # Orange
-        (0, 255, 255), # Cyan
-        (255, 0, 255)  # Magenta
-    ]
-    
-    # Assign a different color to each unique product type
+    # Assign an index to each product type in order of appearance; its color comes from the class ID
     displayed_products = {}
-    color_index = 0
-    
-    for info in product_infos:
-        class_name = info['class_name']
-        price = info['price']
-        in_stock = 'Yes' if info['in_stock'] else 'No'
-        color = colors[color_index % len(colors)]  # Cycle through colors
-
-        if class_name not in displayed_products:
-            displayed_products[class_name] = {
-                'price': price,
-                'in_stock': in_stock,
-                'bboxes': [],
-                'color': color  # Assign color for this product type
+    type_ids = np.empty(len(product_infos), dtype=np.int32)
+    for i, info in enumerate(product_infos):
+        product = displayed_products.get(info['class_name'])
+        if product is None:
+            product = displayed_products[info['class_name']] = {
+                'index': len(displayed_products),
+                'price': info['price'],
+                'in_stock': 'Yes' if info['in_stock'] else 'No',
+                'color': PALETTE[info['class_id'] % len(PALETTE)]
             }
-            color_index += 1
-        displayed_products[class_name]['bboxes'].append(info['bbox'])
+        type_ids[i] = product['index']
+    bboxes = np.array([info['bbox'] for info in product_infos], dtype=np.int32).reshape(-1, 4)
+    colors = [product['color'] for product in displayed_products.values()]
 
-    # Draw bounding boxes and labels
-    for class_name, info in displayed_products.items():
-        price = info['price']
-        in_stock = info['in_stock']
-        bboxes = info['bboxes']
-        color = info['color']
-
-        # Draw bounding boxes for this product
-        for bbox in bboxes:
-            xmin, ymin, xmax, ymax = bbox
-            draw.rectangle([xmin, ymin, xmax, ymax], outline=color, width=3)
-
-        # Choose largest bounding box for text positioning
-        largest_bbox = max(bboxes, key=lambda bbox: (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]))
-        xmin, ymin, xmax, ymax = largest_bbox
-        
-        # Create label with product info
-        label = f"{class_name.capitalize()}: ${price}, In Stock: {in_stock}"
-
-        # Load font
-        font_size = 20
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except IOError:
-            font = ImageFont.load_default()
+    # Draw bounding boxes
+    for (xmin, ymin, xmax, ymax), type_id in zip(bboxes.tolist(), type_ids.tolist()):
+        cv2.rectangle(image, (xmin, ymin), (xmax, ymax), colors[type_id], 3)
 
-        # Calculate text size and position
-        text_bbox = draw.textbbox((xmin, ymin), label, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
+    # Create and measure one label per product type
+    labels = []
+    text_sizes = np.empty((len(displayed_products), 2), dtype=np.int32)
+    for class_name, info in displayed_products.items():
+        label = f"{class_name.capitalize()}: ${info['price']}, In Stock: {info['in_stock']}"
+        (text_width, text_height), baseline = cv2.getTextSize(label, LABEL_FONT, LABEL_FONT_SCALE, LABEL_THICKNESS)
+        labels.append((label, baseline))
+        text_sizes[info['index']] = (text_width, text_height + baseline)
+
+    # Position all labels at once, then draw them
+    image_height, image_width = image.shape[:2]
+    positions = layout_labels(bboxes, type_ids, text_sizes, image_width, image_height)
+    for color, (label, baseline), (text_width, text_height), (text_x, text_y) in zip(colors, labels, text_sizes.tolist(), positions.tolist()):
+        # Draw background for text
+        cv2.rectangle(image, (text_x - 2, text_y - 2), (text_x + text_width + 2, text_y + text_height + 2), (255, 255, 255), -1)
 
-        text_x = xmin
-        text_y = ymin - text_height - 5
+        # Draw product info text using the same color as the bounding box (origin is the baseline)
+        cv2.putText(image, label, (text_x, text_y + text_height - baseline), LABEL_FONT, LABEL_FONT_SCALE, color, LABEL_THICKNESS)
 
-        # Adjust text position if it goes beyond image boundaries
-        if text_x + text_width > image.width:
-            text_x = image.width - text_width - 5
-        if text_y < 0:
-            text_y = ymax + 5
-            if text_y + text_height > image.height:
-                text_y = image.height - text_height - 5
+    # Save output image straight to the static folder it is served from
+    output_image_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    # cv2.imwrite reports failure through its return value rather than raising
+    if not cv2.imwrite(output_image_path, image, OUTPUT_JPEG_PARAMS):
+        print(f"Error writing output image: {output_image_path}")
+        return None
 
-        # Draw background for text
-        draw.rectangle([text_x - 2, text_y - 2, text_x + text_width + 2, text_y + text_height + 2], fill=(255, 255, 255))
+    return output_image_path
 
-        # Draw product info text using the same color as the bounding box
-        draw.text((text_x, text_y), label, fill=color, font=font)
 
-    # Save output image
-    output_image_filename = 'output_' + os.path.basename(image_path)
-    output_image_path = os.path.join(app.config['UPLOAD_FOLDER'], output_image_filename)
-    image.save(output_image_path)
+def letterbox_image(image, size):
+    """
+    Resize the image to fit a square model input, padding the remainder with gray.
 
-    return output_image_path
+    Args:
+        image (np.ndarray): BGR image.
+        size (int): Side of the square model input.
+    
+    Returns:
+        tuple: Letterboxed image, scale factor and (pad_x, pad_y) offsets.
+    """
+    height, width = image.shape[:2]
+    scale = min(size / width, size / height)
+    new_width, new_height = round(width * scale), round(height * scale)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = image
+    return canvas, scale, (pad_x, pad_y)
+
+def decode_image(data, max_size=MAX_IMAGE_SIZE):
+    """
+    Decode image bytes, letting libjpeg downscale large JPEGs while decoding.
 
+    A JPEG is decoded at 1/2, 1/4 or 1/8 scale directly from its DCT coefficients
+    when the result is still at least as large as resize_image would make it.
 
-def resize_image(image_path, max_size=(1024, 1024)):
+    Args:
+        data (bytes): Encoded image.
+        max_size (tuple): Max width and height the image will be resized to.
+    
+    Returns:
+        np.ndarray: BGR image, or None if the data is not a valid image.
+    """
+    flags = cv2.IMREAD_COLOR
+    try:
+        # Parses the JPEG header only; unlike Image.open this skips Pillow's pixel limit,
+        # which would otherwise reject exactly the large photos worth reducing
+        width, height = JpegImagePlugin.JpegImageFile(io.BytesIO(data)).size
+        max_factor = max(width / max_size[0], height / max_size[1])
+        flags = next((reduced for factor, reduced in REDUCED_DECODE_FLAGS if factor <= max_factor), flags)
+    except (SyntaxError, OSError):
+        pass  # Not a readable JPEG; let OpenCV decide whether the data is a valid image
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+
+def resize_image(img, max_size=MAX_IMAGE_SIZE):
     """
     Resize the image for processing efficiency.
 
     Args:
-        image_path (str): Path to the image.
+        img (np.ndarray): BGR image.
         max_size (tuple): Max width and height.
     
     Returns:
-        str: Path to the resized image.
+        np.ndarray: Resized image.
     """
-    img = Image.open(image_path)
-    img.thumbnail(max_size)
-    resized_path = image_path.replace(".jpg", "_resized.jpg")
-    img.save(resized_path)
-    return resized_path
+    height, width = img.shape[:2]
+    scale = min(max_size[0] / width, max_size[1] / height, 1.0)
+    if scale < 1.0:
+        # INTER_AREA gives the best quality when shrinking; keep very thin images at least 1 px wide
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
 
 # --------------------------- Run the Application --------------------------- #
 
+# Development server only; in production run gunicorn -c gunicorn_conf.py app:app
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    init_detector()
+    app.run()
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration for serving the Flask application.
+
+Usage: gunicorn -c gunicorn_conf.py app:app
+
+The app is preloaded once in the master process; each worker then loads its own
+YOLO model after the fork, because CUDA contexts cannot be shared across a fork.
+"""
+
+import os
+
+# Detect CUDA through NVML so the preloaded master never initializes CUDA itself
+os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+# Fail a model export on a missing package instead of pip-installing it inside a worker
+os.environ.setdefault('YOLO_AUTOINSTALL', 'false')
+
+bind = '127.0.0.1:5000'
+# Upload jobs are tracked in process memory, so a client must keep talking to the
+# worker that accepted its upload: scale with threads rather than workers
+workers = 1
+worker_class = 'gthread'
+threads = 8
+preload_app = True
+
+# The first start may export the TensorRT engine inside a worker, which takes minutes
+timeout = 600
+
+
+def post_fork(server, worker):
+    """Load and warm up the YOLO model in each worker process."""
+    from app import init_detector
+    init_detector()